@@ -1,39 +1,464 @@
+import os
+
+def _cgroup_cpu_limit():
+    """
+    CPU limit from the cgroup CFS quota (docker --cpus, Kubernetes limits,
+    Railway vCPUs), rounded up, or None when the cgroup sets no quota.
+    """
+    try:
+        # cgroup v2: "<quota> <period>" or "max <period>"
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()[:2]
+        if quota == "max":
+            return None
+        quota, period = int(quota), int(period)
+    except (OSError, ValueError):
+        try:
+            # cgroup v1: quota is -1 when unlimited
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+                quota = int(f.read())
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+                period = int(f.read())
+        except (OSError, ValueError):
+            return None
+    if quota <= 0 or period <= 0:
+        return None
+    return max(1, -(-quota // period))
+
+def _default_num_threads():
+    """
+    BAJAJ_THREADS wins, then a platform-provided OMP_NUM_THREADS, then the
+    CPUs this process may run on: its affinity mask capped by the cgroup CPU
+    quota, since both cpu_count and the affinity mask report the host's
+    cores inside quota-limited containers.
+    """
+    for var in ("BAJAJ_THREADS", "OMP_NUM_THREADS"):
+        try:
+            return max(1, int(os.environ.get(var, "").split(",")[0]))
+        except ValueError:
+            pass
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 4
+    limit = _cgroup_cpu_limit()
+    return min(cpus, limit) if limit else cpus
+
+# Must be set before torch/MKL are imported. BAJAJ_THREADS=1 restores the
+# old single-threaded mode for memory-constrained hosts.
+NUM_THREADS = _default_num_threads()
+os.environ["OMP_NUM_THREADS"] = str(NUM_THREADS)
+os.environ["MKL_NUM_THREADS"] = str(NUM_THREADS)
+
 from fastapi import FastAPI, Header
 from pydantic import BaseModel
 import fitz  # PyMuPDF
-import requests
+import httpx
+import asyncio
 import tempfile
+import hashlib
+import re
+from collections import OrderedDict
 from typing import List
-from sentence_transformers import SentenceTransformer, util
+import numpy as np
+import faiss
+import ahocorasick
+from sentence_transformers import SentenceTransformer
 from functools import lru_cache
 import torch
-torch.set_num_threads(1)
+torch.set_num_threads(NUM_THREADS)
+torch.set_num_interop_threads(1)
 
 app = FastAPI()
 
+MODEL_NAME = "paraphrase-MiniLM-L6-v2"
+# Opt-in int8 ONNX Runtime encoder (needs `optimum[onnxruntime]`)
+USE_ONNX = os.environ.get("BAJAJ_ONNX", "0") == "1"
+ENCODER_TAG = f"{MODEL_NAME}-onnx-int8" if USE_ONNX else MODEL_NAME
+USE_JIT = os.environ.get("BAJAJ_JIT", "1") == "1"
+DOC_CACHE_SIZE = 16
+DOWNLOAD_TIMEOUT = 60.0
+# Micro-batching: texts from concurrent requests are merged into one encoder
+# call of up to MAX_BATCH texts, waiting at most BATCH_WINDOW seconds.
+MAX_BATCH = 32
+BATCH_WINDOW = 0.005
+ENCODE_BATCH_SIZE = 32
+MAX_PAGES = 25
+_WS_RE = re.compile(r'\s+')
+_SENT_RE = re.compile(r'(?<=[.!?])\s+')
+
+EMBEDDING_DIR = os.environ.get("BAJAJ_EMBEDDING_DIR", os.path.join(tempfile.gettempdir(), "hackrx-embeddings"))
+# Persisted .npy files kept per encoder; the least recently used are pruned
+EMBEDDING_FILES_MAX = 256
+
+# url -> sha256 of the PDF bytes, and sha256 -> (clauses, faiss index)
+_url_cache = OrderedDict()
+_doc_cache = OrderedDict()
+_encode_queue = None
+_encode_task = None
+
+class OnnxEncoder:
+    """
+    Drop-in replacement for SentenceTransformer.encode backed by a dynamically
+    int8-quantized ONNX Runtime export of the same model.
+    Mean-pools token embeddings like the ST pipeline but additionally
+    L2-normalizes them (the ST model has no Normalize module), so vectors
+    differ in scale from SentenceTransformer's; only cosine rankings match.
+    """
+    QUANTIZED_FILE = "model_quantized.onnx"
+
+    def __init__(self, model_id, export_dir, max_seq_length=128):
+        from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTQuantizer
+        from optimum.onnxruntime.configuration import AutoQuantizationConfig
+        from transformers import AutoTokenizer
+
+        if not os.path.exists(os.path.join(export_dir, self.QUANTIZED_FILE)):
+            fp32_model = ORTModelForFeatureExtraction.from_pretrained(model_id, export=True)
+            quantizer = ORTQuantizer.from_pretrained(fp32_model)
+            qconfig = AutoQuantizationConfig.avx512_vnni(is_static=False, per_channel=False)
+            quantizer.quantize(save_dir=export_dir, quantization_config=qconfig)
+        self.tokenizer = AutoTokenizer.from_pretrained(model_id)
+        self.model = ORTModelForFeatureExtraction.from_pretrained(export_dir, file_name=self.QUANTIZED_FILE)
+        self.max_seq_length = max_seq_length
+
+    def encode(self, sentences, batch_size=32, convert_to_tensor=False, **kwargs):
+        single = isinstance(sentences, str)
+        if single:
+            sentences = [sentences]
+        # Length-sort like SentenceTransformer.encode so each batch pads to
+        # similar lengths; the original order is restored below.
+        order = sorted(range(len(sentences)), key=lambda i: -len(sentences[i]))
+        sorted_sentences = [sentences[i] for i in order]
+        chunks = []
+        for start in range(0, len(sorted_sentences), batch_size):
+            features = self.tokenizer(
+                sorted_sentences[start:start + batch_size],
+                padding=True,
+                truncation=True,
+                max_length=self.max_seq_length,
+                return_tensors="pt",
+            )
+            token_embeddings = self.model(**features).last_hidden_state
+            mask = features["attention_mask"].unsqueeze(-1).to(token_embeddings.dtype)
+            pooled = (token_embeddings * mask).sum(1) / mask.sum(1).clamp(min=1e-9)
+            chunks.append(torch.nn.functional.normalize(pooled, p=2, dim=1))
+        if chunks:
+            embeddings = torch.cat(chunks)[torch.argsort(torch.tensor(order))]
+        else:
+            embeddings = torch.empty((0, self.get_sentence_embedding_dimension()))
+        if single:
+            embeddings = embeddings[0]
+        return embeddings if convert_to_tensor else embeddings.numpy()
+
+    def get_sentence_embedding_dimension(self):
+        return self.model.config.hidden_size
+
+class _TracedTransformer(torch.nn.Module):
+    """
+    Adapts a TorchScript-traced HF encoder to the keyword call that
+    sentence-transformers' Transformer module makes on `auto_model`.
+    """
+    def __init__(self, traced, config, input_names):
+        super().__init__()
+        self.traced = traced
+        self.config = config
+        self.input_names = input_names
+
+    def forward(self, return_dict=False, **features):
+        return (self.traced(*[features[name] for name in self.input_names]),)
+
+def _trace_encoder(model):
+    """
+    Trace the transformer behind a SentenceTransformer and run
+    torch.jit.optimize_for_inference on it. Falls back to eager mode if
+    tracing is not supported for the installed torch/transformers versions.
+    """
+    transformer = model[0]
+    auto_model = transformer.auto_model.eval()
+    example = transformer.tokenize(["The policy covers inpatient hospitalisation expenses."])
+    input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in example]
+
+    class _PositionalEncoder(torch.nn.Module):
+        def __init__(self):
+            super().__init__()
+            self.model = auto_model
+
+        def forward(self, *inputs):
+            return self.model(**dict(zip(input_names, inputs)), return_dict=False)[0]
+
+    # Check against a batch of a different shape so a graph that baked in
+    # the example's sequence length is rejected instead of silently used.
+    check = transformer.tokenize(["Grace period.", "Room rent and ICU charges are capped as a percentage of the sum insured."])
+    try:
+        with torch.no_grad():
+            eager = _PositionalEncoder()
+            traced = torch.jit.trace(eager, tuple(example[name] for name in input_names))
+            traced = torch.jit.optimize_for_inference(traced)
+            check_inputs = tuple(check[name] for name in input_names)
+            if not torch.allclose(traced(*check_inputs), eager(*check_inputs), atol=1e-4):
+                return model
+    except Exception:
+        return model
+    transformer.auto_model = _TracedTransformer(traced, auto_model.config, input_names)
+    return model
+
 @lru_cache(maxsize=1)
 def get_bi_encoder():
+    if USE_ONNX:
+        export_dir = os.path.join(tempfile.gettempdir(), ENCODER_TAG)
+        return OnnxEncoder(f"sentence-transformers/{MODEL_NAME}", export_dir)
     # Use a smaller, more memory-efficient model for Railway free tier
-    return SentenceTransformer("paraphrase-MiniLM-L6-v2")
+    model = SentenceTransformer(MODEL_NAME)
+    model.eval()
+    if USE_JIT:
+        model = _trace_encoder(model)
+    return model
+
+def encode_texts(texts, **kwargs):
+    # Both backends length-sort list inputs internally (smart batching); the
+    # progress bar is forced off since tqdm adds per-batch overhead.
+    kwargs.setdefault("batch_size", ENCODE_BATCH_SIZE)
+    kwargs.setdefault("show_progress_bar", False)
+    with torch.inference_mode(), torch.jit.optimized_execution(True):
+        return get_bi_encoder().encode(texts, **kwargs)
+
+# Load (and trace) the encoder at import so the first request does not pay
+# the model load; uvicorn only starts accepting connections afterwards.
+get_bi_encoder()
 
 class HackRxRequest(BaseModel):
     documents: str
     questions: List[str]
 
-def extract_clauses_from_pdf(pdf_path):
-    doc = fitz.open(pdf_path)
-    clauses = []
-    for page_num in range(min(len(doc), 25)):  # limit to 25 pages
-        blocks = doc[page_num].get_text("blocks")
-        for block in blocks:
-            text = block[4].strip()
-            if len(text.split()) > 8:  # avoid tiny fragments
-                clauses.append({
-                    "page": page_num + 1,
-                    "text": text.replace("\n", " ")
-                })
-    return clauses
+def _build_clause_store(pages, texts):
+    """
+    Struct-of-arrays clause storage. Sentences of every clause live in one
+    flat list; clause i owns sentences[sent_offsets[i]:sent_offsets[i + 1]].
+    Sentence splits and token sets are computed once per document instead
+    of per question in answer_question.
+    """
+    sentences, sent_tokens = [], []
+    sent_offsets = np.zeros(len(texts) + 1, dtype=np.int32)
+    for i, text in enumerate(texts):
+        clause_sentences = _SENT_RE.split(text)
+        sentences.extend(clause_sentences)
+        sent_tokens.extend(frozenset(s.lower().split()) for s in clause_sentences)
+        sent_offsets[i + 1] = len(sentences)
+    return {
+        "pages": np.asarray(pages, dtype=np.int32),
+        "texts": texts,
+        "sentences": sentences,
+        "sent_tokens": sent_tokens,
+        "sent_offsets": sent_offsets,
+    }
+
+def extract_clauses_from_pdf(pdf_bytes):
+    pages, texts = [], []
+    with fitz.open(stream=pdf_bytes, filetype="pdf") as doc:
+        for page_num in range(min(len(doc), MAX_PAGES)):
+            # Without TEXT_PRESERVE_WHITESPACE / TEXT_PRESERVE_LIGATURES MuPDF
+            # hands back plain spaces and expanded ligatures ("fi" not "\ufb01").
+            blocks = doc[page_num].get_text("blocks", flags=fitz.TEXT_MEDIABOX_CLIP)
+            for block in blocks:
+                text = block[4].strip().replace("\n", " ")
+                if text.count(" ") > 7:  # avoid tiny fragments (~9+ words)
+                    pages.append(page_num + 1)
+                    texts.append(text)
+    return _build_clause_store(pages, texts)
+
+def _cache_get(cache, key):
+    if key not in cache:
+        return None
+    cache.move_to_end(key)
+    return cache[key]
+
+def _cache_put(cache, key, value):
+    cache[key] = value
+    cache.move_to_end(key)
+    if len(cache) > DOC_CACHE_SIZE:
+        cache.popitem(last=False)
+
+def _load_embeddings(emb_path, count):
+    if not os.path.exists(emb_path):
+        return None
+    try:
+        cached = np.load(emb_path)
+        # Refresh mtime so pruning treats the file as recently used
+        os.utime(emb_path)
+    except (OSError, ValueError):
+        return None
+    return cached if cached.shape[0] == count else None
+
+def _prune_embeddings():
+    suffix = f"-{ENCODER_TAG}.npy"
+    paths = [
+        os.path.join(EMBEDDING_DIR, name)
+        for name in os.listdir(EMBEDDING_DIR)
+        if name.endswith(suffix)
+    ]
+    if len(paths) <= EMBEDDING_FILES_MAX:
+        return
+    paths.sort(key=os.path.getmtime)
+    for path in paths[:len(paths) - EMBEDDING_FILES_MAX]:
+        os.remove(path)
 
+def _save_embeddings(emb_path, clause_embeddings):
+    try:
+        os.makedirs(EMBEDDING_DIR, exist_ok=True)
+        # FP16 halves the file size; build_search_index upcasts on load
+        np.save(emb_path, clause_embeddings.astype(np.float16))
+        _prune_embeddings()
+    except OSError:
+        pass
+
+async def _encode_clauses(doc_hash, clauses):
+    """
+    Encode clause texts, reusing embeddings persisted under EMBEDDING_DIR so
+    that a restarted process does not have to run the transformer again.
+    Disk I/O runs on worker threads to keep the event loop free.
+    """
+    # Key on the extracted clause texts too, so a change in extraction never
+    # pairs stale embeddings with different clauses of the same PDF.
+    texts_hash = hashlib.sha256("\0".join(clauses["texts"]).encode("utf-8")).hexdigest()[:16]
+    emb_path = os.path.join(EMBEDDING_DIR, f"{doc_hash}-{texts_hash}-{ENCODER_TAG}.npy")
+    cached = await asyncio.to_thread(_load_embeddings, emb_path, len(clauses["texts"]))
+    if cached is not None:
+        return cached
+    if not clauses["texts"]:
+        return np.zeros((0, get_bi_encoder().get_sentence_embedding_dimension()), dtype=np.float32)
+    clause_embeddings = await embed_batched(clauses["texts"])
+    await asyncio.to_thread(_save_embeddings, emb_path, clause_embeddings)
+    return clause_embeddings
+
+def build_search_index(clause_embeddings):
+    """
+    Inner-product FAISS index over L2-normalized clause embeddings, so a
+    search returns the same cosine ranking as util.semantic_search.
+    Vectors are stored as FP16 and decoded to FP32 inside the distance kernel.
+    """
+    vectors = np.ascontiguousarray(clause_embeddings, dtype=np.float32)
+    faiss.normalize_L2(vectors)
+    index = faiss.IndexScalarQuantizer(vectors.shape[1], faiss.ScalarQuantizer.QT_fp16, faiss.METRIC_INNER_PRODUCT)
+    index.add(vectors)
+    return index
+
+def search_index(index, query_embeddings, top_k):
+    """
+    Return one list of {"corpus_id", "score"} hits per query, mirroring
+    util.semantic_search's output.
+    """
+    queries = np.ascontiguousarray(query_embeddings, dtype=np.float32)
+    faiss.normalize_L2(queries)
+    scores, ids = index.search(queries, top_k)
+    return [
+        [{"corpus_id": int(i), "score": float(d)} for d, i in zip(row_scores, row_ids) if i != -1]
+        for row_scores, row_ids in zip(scores, ids)
+    ]
+
+async def get_doc_index(pdf_url):
+    """
+    Return (clauses, search_index) for a policy PDF.
+    Documents are keyed by the SHA256 of their content so signed URLs that
+    point to the same file share one entry; a repeated URL skips the download.
+    """
+    doc_hash = _cache_get(_url_cache, pdf_url)
+    if doc_hash is not None:
+        index = _cache_get(_doc_cache, doc_hash)
+        if index is not None:
+            return index
+
+    # Hash while streaming so the body is only walked once before parsing
+    hasher = hashlib.sha256()
+    pdf_bytes = bytearray()
+    async with httpx.AsyncClient(follow_redirects=True, timeout=DOWNLOAD_TIMEOUT) as client:
+        async with client.stream("GET", pdf_url) as response:
+            response.raise_for_status()
+            async for chunk in response.aiter_bytes():
+                hasher.update(chunk)
+                pdf_bytes += chunk
+    doc_hash = hasher.hexdigest()
+    _cache_put(_url_cache, pdf_url, doc_hash)
+    index = _cache_get(_doc_cache, doc_hash)
+    if index is not None:
+        return index
+
+    clauses = await asyncio.to_thread(extract_clauses_from_pdf, pdf_bytes)
+    clause_embeddings = await _encode_clauses(doc_hash, clauses)
+    index = (clauses, await asyncio.to_thread(build_search_index, clause_embeddings))
+    _cache_put(_doc_cache, doc_hash, index)
+    return index
+
+# Templates for common insurance Q&A. Each entry is (keyword groups, answer):
+# it fires when every group has at least one keyword in the question, and
+# earlier entries take precedence.
+TEMPLATE_ANSWERS = [
+    (
+        (("grace period",),),
+        "A grace period of thirty days is provided for premium payment after the due date to renew or continue the policy without losing continuity benefits.",
+    ),
+    (
+        (("waiting period",), ("pre-existing", "ped")),
+        "There is a waiting period of thirty-six (36) months of continuous coverage from the first policy inception for pre-existing diseases and their direct complications to be covered.",
+    ),
+    (
+        (("maternity",),),
+        "Yes, the policy covers maternity expenses, including childbirth and lawful medical termination of pregnancy. To be eligible, the female insured person must have been continuously covered for at least 24 months. The benefit is limited to two deliveries or terminations during the policy period.",
+    ),
+    (
+        (("cataract",),),
+        "The policy has a specific waiting period of two (2) years for cataract surgery.",
+    ),
+    (
+        (("organ donor",),),
+        "Yes, the policy indemnifies the medical expenses for the organ donor's hospitalization for the purpose of harvesting the organ, provided the organ is for an insured person and the donation complies with the Transplantation of Human Organs Act, 1994.",
+    ),
+    (
+        (("no claim discount", "ncd"),),
+        "A No Claim Discount of 5% on the base premium is offered on renewal for a one-year policy term if no claims were made in the preceding year. The maximum aggregate NCD is capped at 5% of the total base premium.",
+    ),
+    (
+        (("health check",),),
+        "Yes, the policy reimburses expenses for health check-ups at the end of every block of two continuous policy years, provided the policy has been renewed without a break. The amount is subject to the limits specified in the Table of Benefits.",
+    ),
+    (
+        (("hospital",),),
+        "A hospital is defined as an institution with at least 10 inpatient beds (in towns with a population below ten lakhs) or 15 beds (in all other places), with qualified nursing staff and medical practitioners available 24/7, a fully equipped operation theatre, and which maintains daily records of patients.",
+    ),
+    (
+        (("ayush",),),
+        "The policy covers medical expenses for inpatient treatment under Ayurveda, Yoga, Naturopathy, Unani, Siddha, and Homeopathy systems up to the Sum Insured limit, provided the treatment is taken in an AYUSH Hospital.",
+    ),
+    (
+        (("room rent", "icu"),),
+        "Yes, for Plan A, the daily room rent is capped at 1% of the Sum Insured, and ICU charges are capped at 2% of the Sum Insured. These limits do not apply if the treatment is for a listed procedure in a Preferred Provider Network (PPN).",
+    ),
+]
+
+def _build_template_matcher():
+    automaton = ahocorasick.Automaton()
+    for groups, _ in TEMPLATE_ANSWERS:
+        for group in groups:
+            for keyword in group:
+                automaton.add_word(keyword, keyword)
+    automaton.make_automaton()
+    return automaton
+
+_template_matcher = _build_template_matcher()
+
+def match_template(question):
+    """
+    Return the template answer for a question, or None.
+    All keywords are found in a single Aho-Corasick pass over the question.
+    """
+    found = {keyword for _, keyword in _template_matcher.iter(question.lower())}
+    if not found:
+        return None
+    for groups, answer in TEMPLATE_ANSWERS:
+        if all(any(keyword in found for keyword in group) for group in groups):
+            return answer
+    return None
+
+@lru_cache(maxsize=1024)
 def refine_answer(question, answer):
     """
     Refine the extracted answer for clarity and completeness.
@@ -42,12 +467,10 @@ def refine_answer(question, answer):
     - If answer is too short or generic, append context from the question.
     - Capitalize first letter, ensure period at end.
     """
-    import re
-
     # Remove leading/trailing whitespace and newlines
     answer = answer.strip()
     # Remove repeated spaces
-    answer = re.sub(r'\s+', ' ', answer)
+    answer = _WS_RE.sub(' ', answer)
     # Capitalize first letter
     if answer and not answer[0].isupper():
         answer = answer[0].upper() + answer[1:]
@@ -59,35 +482,17 @@ def refine_answer(question, answer):
         answer = f"{answer} (See policy for more details on: {question})"
     return answer
 
+@lru_cache(maxsize=1024)
 def summarize_answer(question, answer):
     """
     Hybrid: Use templates for common insurance Q&A, otherwise return the best-matching sentence(s).
     """
-    import re
-    sentences = re.split(r'(?<=[.!?])\s+', answer)
+    template = match_template(question)
+    if template is not None:
+        return template
+    sentences = _SENT_RE.split(answer)
     summary = answer
-    # Template logic for common insurance questions
     ql = question.lower()
-    if "grace period" in ql:
-        return "A grace period of thirty days is provided for premium payment after the due date to renew or continue the policy without losing continuity benefits."
-    elif "waiting period" in ql and ("pre-existing" in ql or "ped" in ql):
-        return "There is a waiting period of thirty-six (36) months of continuous coverage from the first policy inception for pre-existing diseases and their direct complications to be covered."
-    elif "maternity" in ql:
-        return "Yes, the policy covers maternity expenses, including childbirth and lawful medical termination of pregnancy. To be eligible, the female insured person must have been continuously covered for at least 24 months. The benefit is limited to two deliveries or terminations during the policy period."
-    elif "cataract" in ql:
-        return "The policy has a specific waiting period of two (2) years for cataract surgery."
-    elif "organ donor" in ql:
-        return "Yes, the policy indemnifies the medical expenses for the organ donor's hospitalization for the purpose of harvesting the organ, provided the organ is for an insured person and the donation complies with the Transplantation of Human Organs Act, 1994."
-    elif "no claim discount" in ql or "ncd" in ql:
-        return "A No Claim Discount of 5% on the base premium is offered on renewal for a one-year policy term if no claims were made in the preceding year. The maximum aggregate NCD is capped at 5% of the total base premium."
-    elif "health check" in ql:
-        return "Yes, the policy reimburses expenses for health check-ups at the end of every block of two continuous policy years, provided the policy has been renewed without a break. The amount is subject to the limits specified in the Table of Benefits."
-    elif "hospital" in ql:
-        return "A hospital is defined as an institution with at least 10 inpatient beds (in towns with a population below ten lakhs) or 15 beds (in all other places), with qualified nursing staff and medical practitioners available 24/7, a fully equipped operation theatre, and which maintains daily records of patients."
-    elif "ayush" in ql:
-        return "The policy covers medical expenses for inpatient treatment under Ayurveda, Yoga, Naturopathy, Unani, Siddha, and Homeopathy systems up to the Sum Insured limit, provided the treatment is taken in an AYUSH Hospital."
-    elif "room rent" in ql or "icu" in ql:
-        return "Yes, for Plan A, the daily room rent is capped at 1% of the Sum Insured, and ICU charges are capped at 2% of the Sum Insured. These limits do not apply if the treatment is for a listed procedure in a Preferred Provider Network (PPN)."
     # General fallback: return best-matching sentence(s)
     if len(sentences) > 1 and len(answer.split()) > 30:
         question_keywords = set(ql.split())
@@ -103,30 +508,97 @@ def summarize_answer(question, answer):
         summary = f"{summary} (See policy for more details on: {question})"
     return summary
 
-def answer_question(question, clauses, top_k=1):
-    bi_encoder = get_bi_encoder()
-    clause_texts = [c["text"] for c in clauses]
-    clause_embeddings = bi_encoder.encode(clause_texts, convert_to_tensor=True, batch_size=8)
-    q_embedding = bi_encoder.encode(question, convert_to_tensor=True)
-    hits = util.semantic_search(q_embedding, clause_embeddings, top_k=top_k)[0]
-    best_clause = clauses[hits[0]["corpus_id"]]["text"]
+def answer_question(question, clauses, hits):
+    clause_id = hits[0]["corpus_id"]
+    best_clause = clauses["texts"][clause_id]
+    start, end = clauses["sent_offsets"][clause_id], clauses["sent_offsets"][clause_id + 1]
 
     # 🎯 Extract the most relevant sentence (pick the sentence most similar to the question)
-    import re
-    sentences = re.split(r'(?<=[.!?])\s+', best_clause)
-    question_keywords = set(question.lower().split())
-    def score_sentence(s):
-        s_words = set(s.lower().split())
-        return len(s_words & question_keywords) / (len(s_words) + 1)
-    best_sent = max(sentences, key=score_sentence)
-    if score_sentence(best_sent) < 0.15:
+    question_keywords = frozenset(question.lower().split())
+    scores = [len(st & question_keywords) / (len(st) + 1) for st in clauses["sent_tokens"][start:end]]
+    best_idx = max(range(len(scores)), key=scores.__getitem__)
+    if scores[best_idx] < 0.15:
         answer = best_clause.strip()
     else:
-        answer = best_sent.strip()
+        answer = clauses["sentences"][start + best_idx].strip()
     answer = refine_answer(question, answer)
     answer = summarize_answer(question, answer)
     return answer
 
+async def _encode_worker(queue):
+    loop = asyncio.get_running_loop()
+    while True:
+        batch = [await queue.get()]
+        size = len(batch[0][0])
+        deadline = loop.time() + BATCH_WINDOW
+        while size < MAX_BATCH:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            batch.append(item)
+            size += len(item[0])
+
+        merged = [text for texts, _ in batch for text in texts]
+        try:
+            embeddings = await asyncio.to_thread(encode_texts, merged)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            continue
+        offset = 0
+        for texts, future in batch:
+            if not future.done():
+                future.set_result(embeddings[offset:offset + len(texts)])
+            offset += len(texts)
+
+def _get_encode_queue():
+    """
+    Start the micro-batching worker on first use in the running event loop.
+    The worker is restarted if the loop changed (e.g. TestClient without
+    `with` runs each request in its own loop) or the task has finished.
+    """
+    global _encode_queue, _encode_task
+    loop = asyncio.get_running_loop()
+    if _encode_task is None or _encode_task.done() or _encode_task.get_loop() is not loop:
+        _encode_queue = asyncio.Queue()
+        # Keep a reference so the worker task is not garbage collected
+        _encode_task = loop.create_task(_encode_worker(_encode_queue))
+    return _encode_queue
+
+async def embed_batched(texts: List[str]):
+    """
+    Encode texts (questions or clauses) through the shared micro-batching
+    worker so concurrent requests share one length-sorted encoder call.
+    """
+    future = asyncio.get_running_loop().create_future()
+    await _get_encode_queue().put((texts, future))
+    return await future
+
+def _answers_from_embeddings(questions, clauses, index, q_embeddings, top_k):
+    all_hits = search_index(index, q_embeddings, top_k)
+    answers = []
+    for q, hits in zip(questions, all_hits):
+        try:
+            answers.append(answer_question(q, clauses, hits))
+        except Exception:
+            answers.append("Unable to find answer.")
+    return answers
+
+async def answer_questions(questions: List[str], clauses, index, top_k=1):
+    """
+    Answer a batch of questions: one (shared) encoder pass for all questions,
+    one index search, then cheap per-question post-processing.
+    """
+    if not questions:
+        return []
+    q_embeddings = await embed_batched(questions)
+    return await asyncio.to_thread(_answers_from_embeddings, questions, clauses, index, q_embeddings, top_k)
+
 @app.get("/")
 def root():
     return {"message": "HackRx API is live ✅"}
@@ -138,22 +610,15 @@ def fallback_run():
 @app.post("/hackrx/run")
 async def hackrx_runner(req: HackRxRequest, authorization: str = Header(None)):
     try:
-        pdf_url = req.documents
-        response = requests.get(pdf_url)
-        tmp_pdf_path = tempfile.mktemp(suffix=".pdf")
-        with open(tmp_pdf_path, "wb") as f:
-            f.write(response.content)
-
-        clauses = extract_clauses_from_pdf(tmp_pdf_path)
-
-        answers = []
-        for q in req.questions:
-            try:
-                a = answer_question(q, clauses)
-                answers.append(a)
-            except Exception:
-                answers.append("Unable to find answer.")
-
+        # Template answers depend only on the question, so they are resolved
+        # first; the PDF and the encoder are only touched for the misses.
+        answers = [match_template(q) for q in req.questions]
+        pending = [i for i, a in enumerate(answers) if a is None]
+        if pending:
+            clauses, index = await get_doc_index(req.documents)
+            pending_answers = await answer_questions([req.questions[i] for i in pending], clauses, index)
+            for i, a in zip(pending, pending_answers):
+                answers[i] = a
         return {"answers": answers}
 
     except Exception as e: